@@ -0,0 +1,437 @@
+"""
+Benchmark for TerminalExporter, running headless (no desktop session needed).
+
+TerminalExporter is loaded with stand-in modules for gi and terminatorlib;
+a fake vte emits contents-changed at a configurable rate and buffer size.
+Measured are CPU time per signal, bytes/s written, peak memory and log
+accuracy for logging, plus export, console and text extraction speed.
+
+usage: python3 benchmark/TerminalExporterBenchmark.py --help
+
+licence: public domain
+"""
+
+import argparse
+import json
+from collections import Counter
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from os import path
+
+PLUGIN_DIR = path.join(path.dirname(path.abspath(__file__)), path.pardir, 'plugins')
+
+# plugin config overrides; filled from command line before the plugin is created
+PLUGIN_CONFIG = {}
+
+
+class FakeWidget(object):
+    """Minimal GObject signal handling and a sink for gtk calls we do not care about"""
+
+    def __init__(self, *_):
+        self.handlers = {}
+        self.next_handler_id = 0
+        self.submenu = None
+        self.children = []
+
+    def connect(self, signal, callback, *data):
+        self.next_handler_id += 1
+        self.handlers[self.next_handler_id] = (signal, callback, data)
+        return self.next_handler_id
+
+    def disconnect(self, handler_id):
+        del self.handlers[handler_id]
+
+    def handler_is_connected(self, handler_id):
+        return handler_id in self.handlers
+
+    def emit(self, signal, *arguments):
+        for name, callback, data in list(self.handlers.values()):
+            if name == signal:
+                callback(self, *(arguments + data))
+
+    def append(self, child):
+        self.children.append(child)
+
+    def set_submenu(self, submenu):
+        self.submenu = submenu
+
+    def set_sensitive(self, _):
+        pass
+
+
+class FakeVte(FakeWidget):
+    """
+    Stand-in for Vte.Terminal. Keeps at most scrollback_lines complete lines
+    plus the cursor row (a prompt, for example); rows are numbered from the
+    start of the session like vte does. Like vte, text ranges include
+    end_row and end_col, so the cursor row is part of a range ending at the
+    cursor.
+    """
+
+    def __init__(self, scrollback_lines, provide_format=True):
+        super(FakeVte, self).__init__()
+        self.scrollback_lines = scrollback_lines
+        self.first_row = 0
+        self.lines = []
+        self.cursor_line = ''
+        if provide_format:
+            self.get_text_range_format = self.text_range_format
+
+    def write(self, lines, prompt=''):
+        """
+        Complete the cursor row with lines[0], add the other lines and leave
+        prompt in the new cursor row.
+        """
+        if lines:
+            self.lines.append(self.cursor_line + lines[0])
+            self.lines.extend(lines[1:])
+            self.cursor_line = prompt
+        overflow = len(self.lines) - self.scrollback_lines
+        if overflow > 0:
+            del self.lines[:overflow]
+            self.first_row += overflow
+
+    def get_cursor_position(self):
+        return len(self.cursor_line), self.first_row + len(self.lines)
+
+    def row_text(self, row):
+        index = row - self.first_row
+        if 0 <= index < len(self.lines):
+            return self.lines[index]
+        return self.cursor_line if index == len(self.lines) else ''
+
+    def rows(self, start_row, start_col, end_row, end_col):
+        """@return: list of (row, text); rows before end_row end with a line break"""
+        rows = []
+        for row in range(start_row, end_row + 1):
+            text = self.row_text(row)
+            if row == end_row:
+                text = text[:end_col + 1]
+            else:
+                text += '\n'
+            if row == start_row:
+                text = text[start_col:]
+            rows.append((row, text))
+        return rows
+
+    def get_text_range(self, start_row, start_col, end_row, end_col, is_selected, user_data=None):
+        rows = self.rows(start_row, start_col, end_row, end_col)
+        if is_selected is not None:
+            # like vte, ask python about every single cell
+            for row, text in rows:
+                for column in range(len(text)):
+                    is_selected(self, column, row, user_data)
+        return ''.join(text for _, text in rows)
+
+    def text_range_format(self, _, start_row, start_col, end_row, end_col):
+        text = ''.join(text for _, text in self.rows(start_row, start_col, end_row, end_col))
+        return text, len(text)
+
+
+class FakeTitlebar(object):
+
+    def __init__(self, caption):
+        self.caption = caption
+
+    def get_custom_string(self):
+        return self.caption
+
+    def set_custom_string(self, caption):
+        self.caption = caption
+
+
+class FakeParent(FakeWidget):
+    """Stand-in for terminator's container; split_axis adds a second terminal"""
+
+    def split_axis(self, terminal, _):
+        self.children = [terminal, FakeTerminal(None, 'console', self)]
+
+    def get_children(self):
+        return self.children
+
+
+class FakeTerminal(FakeWidget):
+    """Stand-in for terminatorlib's Terminal"""
+
+    def __init__(self, vte, caption, parent=None, group=None):
+        super(FakeTerminal, self).__init__()
+        self.vte = vte
+        self.titlebar = FakeTitlebar(caption)
+        self.group = group
+        self.parent = parent or FakeParent()
+        self.fed = []
+        self.terminator = None
+
+    def get_vte(self):
+        return self.vte
+
+    def get_parent(self):
+        return self.parent
+
+    def get_toplevel(self):
+        return self.terminator
+
+    def get_cwd(self):
+        return os.getcwd()
+
+    def feed(self, text):
+        self.fed.append(text)
+
+
+class FakeConfig(dict):
+    """Stand-in for terminatorlib.config.Config"""
+
+    def __init__(self):
+        super(FakeConfig, self).__init__(scrollback_lines=PLUGIN_CONFIG.get('scrollback_lines', 500))
+
+    @staticmethod
+    def plugin_get_config(_):
+        return dict((key, value) for key, value in PLUGIN_CONFIG.items() if key != 'scrollback_lines')
+
+
+def install_fake_modules():
+    """Register stand-ins for gi and terminatorlib, so the plugin imports headless"""
+
+    def add_module(name, **attributes):
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+    gtk = types.SimpleNamespace(MenuItem=FakeWidget, Menu=FakeWidget, SeparatorMenuItem=FakeWidget)
+    glib = types.SimpleNamespace(timeout_add_seconds=lambda *_: 0)
+    vte = types.SimpleNamespace(Format=types.SimpleNamespace(TEXT=0))
+    add_module('gi')
+    add_module('gi.repository', Gtk=gtk, GLib=glib, Vte=vte)
+    add_module('terminatorlib')
+    add_module('terminatorlib.plugin', MenuItem=object)
+    add_module('terminatorlib.util', dbg=lambda _: None, err=lambda message: sys.stderr.write(message + '\n'))
+    add_module('terminatorlib.config', Config=FakeConfig)
+
+
+def make_lines(count, width, first=0):
+    return [('%08d ' % number).ljust(width, 'x') for number in range(first, first + count)]
+
+
+def peak_memory():
+    """@return: (python heap peak since last reset, process max rss) in bytes"""
+    traced = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+    return traced, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measured(function):
+    """
+    Run function; measure wall time, cpu time and python heap peak.
+    @return: (result of function, dict of measures)
+    """
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = function()
+    measures = {'wall_s': time.perf_counter() - wall,
+                'cpu_s': time.process_time() - cpu}
+    measures['heap_peak_bytes'], measures['max_rss_bytes'] = peak_memory()
+    return result, measures
+
+
+def create_plugin(module, extraction):
+    exporter = module.TerminalExporter()
+    exporter.text_extraction = extraction
+    return exporter
+
+
+def bench_log(module, options, extraction):
+    """Log a terminal, that changes signals times; check the log for accuracy"""
+    exporter = create_plugin(module, extraction)
+    vte = FakeVte(options.scrollback, extraction == module.EXTRACTION_FORMAT)
+    vte.write(make_lines(options.buffer_lines, options.width), options.prompt)
+    terminal = FakeTerminal(vte, 'log')
+    exporter.do_log(None, terminal)
+    filename = exporter.logging_terminals[terminal].filename
+    interval = 1.0 / options.rate if options.rate > 0 else 0
+    first = options.buffer_lines
+    expected = []
+
+    def emit_all():
+        for signal in range(options.signals):
+            started = time.perf_counter()
+            # a command, typed after the prompt, followed by its output
+            lines = ['command %d' % signal] + make_lines(options.lines_per_signal, options.width,
+                                                         first + signal * options.lines_per_signal)
+            expected.append(vte.cursor_line + lines[0])
+            expected.extend(lines[1:])
+            vte.write(lines, options.prompt)
+            vte.emit('contents-changed')
+            if interval:
+                time.sleep(max(0, interval - (time.perf_counter() - started)))
+
+    _, measures = measured(emit_all)
+    if terminal in exporter.logging_terminals:
+        exporter.do_stop_log(None, terminal)
+    logged_bytes = path.getsize(filename)
+    with open(filename) as input_file:
+        logged = strip_timestamps(module, input_file.read()).splitlines()
+    measures.update(check_accuracy(expected, logged, bool(options.ring_size)))
+    measures.update({'signals': options.signals,
+                     'cpu_per_signal_ms': measures['cpu_s'] * 1000 / options.signals,
+                     'log_notify_mean_ms': exporter.stats.notify.mean() * 1000,
+                     'get_text_range_mean_ms': exporter.stats.text_range.mean() * 1000,
+                     'logged_bytes': logged_bytes,
+                     'bytes_per_s': logged_bytes / measures['wall_s']})
+    return measures
+
+
+def check_accuracy(expected, logged, ring):
+    """
+    Compare logged lines with the lines, the terminal showed.
+    @param ring: ring buffer mode; lines before the oldest kept one are not missing
+    @return: dict with counts of missing, duplicated and unexpected lines
+    """
+    if ring:
+        expected_set = set(expected)
+        first = next((line for line in logged if line in expected_set), None)
+        expected = expected[expected.index(first):] if first is not None else []
+    expected_counts, logged_counts = Counter(expected), Counter(logged)
+    missing = sum((expected_counts - logged_counts).values())
+    surplus = logged_counts - expected_counts
+    duplicated = sum(count for line, count in surplus.items() if line in expected_counts)
+    unexpected = sum(count for line, count in surplus.items() if line not in expected_counts)
+    return {'missing_lines': missing,
+            'duplicated_lines': duplicated,
+            'unexpected_lines': unexpected,
+            'accurate': not (missing or duplicated or unexpected)}
+
+
+def strip_timestamps(module, content):
+    """remove timestamps, written by logTimestamps mode"""
+    return ''.join(line[module.TIMESTAMP_PREFIX_LENGTH:] if module.parse_timestamp(line.encode('utf-8')) else line
+                   for line in content.splitlines(True))
+
+
+def bench_export(module, options, extraction):
+    """Export a full buffer repeatedly"""
+    exporter = create_plugin(module, extraction)
+    vte = FakeVte(options.scrollback, extraction == module.EXTRACTION_FORMAT)
+    vte.write(make_lines(min(options.buffer_lines, options.scrollback), options.width), options.prompt)
+    terminal = FakeTerminal(vte, 'export')
+    filenames, measures = measured(lambda: [exporter.do_export(None, terminal) for _ in range(options.exports)])
+    exported_bytes = sum(path.getsize(filename) for filename in filenames)
+    measures.update({'exports': options.exports,
+                     'cpu_per_export_ms': measures['cpu_s'] * 1000 / options.exports,
+                     'exported_bytes': exported_bytes,
+                     'bytes_per_s': exported_bytes / measures['wall_s']})
+    return measures
+
+
+def bench_console(module, options, extraction):
+    """Open console (export, start log and split) for a fresh terminal"""
+    exporter = create_plugin(module, extraction)
+    vte = FakeVte(options.scrollback, extraction == module.EXTRACTION_FORMAT)
+    vte.write(make_lines(min(options.buffer_lines, options.scrollback), options.width), options.prompt)
+    terminal = FakeTerminal(vte, 'console')
+    _, measures = measured(lambda: exporter.do_console(None, terminal))
+    console = terminal.get_parent().get_children()[1]
+    measures.update({'aliases': sum(1 for text in console.fed if text.startswith('alias '))})
+    exporter.do_stop_log(None, terminal)
+    return measures
+
+
+def bench_extraction(module, options, extraction):
+    """Raw text extraction speed of one extraction path, in MB/s"""
+    vte = FakeVte(options.scrollback, extraction == module.EXTRACTION_FORMAT)
+    vte.write(make_lines(min(options.buffer_lines, options.scrollback), options.width), options.prompt)
+    end_column, end_row = vte.get_cursor_position()
+
+    def extract():
+        return sum(len(module.extract_text_range(vte, vte.first_row, end_row, end_column, extraction))
+                   for _ in range(options.exports))
+
+    extracted, measures = measured(extract)
+    measures.update({'extracted_bytes': extracted,
+                     'mb_per_s': extracted / measures['wall_s'] / 1024 / 1024})
+    return measures
+
+
+SCENARIOS = {'log': bench_log,
+             'export': bench_export,
+             'console': bench_console,
+             'extraction': bench_extraction}
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description='TerminalExporter benchmark with a fake vte')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run; may be repeated (default: all)')
+    parser.add_argument('--extraction', action='append', choices=['callback', 'no-callback', 'format'],
+                        help='text extraction path; may be repeated (default: all)')
+    parser.add_argument('--signals', type=int, default=2000, help='contents-changed signals to emit')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='signals per second; 0 emits as fast as possible')
+    parser.add_argument('--lines-per-signal', type=int, default=5, help='new lines per signal')
+    parser.add_argument('--prompt', default='',
+                        help="text left in the cursor row after every signal, '$ ' for example; "
+                             "shows the prompt problem of 'log terminal' (default: none)")
+    parser.add_argument('--width', type=int, default=120, help='characters per line')
+    parser.add_argument('--buffer-lines', type=int, default=10000, help='lines in buffer before start')
+    parser.add_argument('--scrollback', type=int, default=10000, help="terminator's scrollback_lines")
+    parser.add_argument('--exports', type=int, default=20, help='repetitions for export and extraction')
+    parser.add_argument('--timestamps', action='store_true', help='log with logTimestamps')
+    parser.add_argument('--ring-size', default='', help='log with logRingBufferSize (64M for example)')
+    parser.add_argument('--index', action='store_true', help='enable the search index (searchIndex)')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='measure python heap peak per scenario (slows down everything)')
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    parser.add_argument('--keep', action='store_true', help='keep the export directory')
+    return parser.parse_args(argv)
+
+
+def print_results(results):
+    for name, measures in results:
+        sys.stdout.write('%s\n' % name)
+        for key in sorted(measures):
+            value = measures[key]
+            sys.stdout.write('  %-24s %s\n' % (key, '%.4f' % value if isinstance(value, float) else value))
+
+
+def main(argv):
+    options = parse_arguments(argv[1:])
+    directory = tempfile.mkdtemp(prefix='TerminalExporterBenchmark')
+    PLUGIN_CONFIG.update({'directory': directory,
+                          'exportNameToFile': path.join(directory, '.terminatorExports'),
+                          'scrollback_lines': options.scrollback,
+                          'logTimestamps': str(options.timestamps),
+                          'logRingBufferSize': options.ring_size or '0',
+                          'statsFile': ''})
+    if options.index:
+        PLUGIN_CONFIG['searchIndex'] = '.terminatorIndex'
+    install_fake_modules()
+    sys.path.insert(0, PLUGIN_DIR)
+    import TerminalExporter as module
+
+    if options.trace_memory:
+        tracemalloc.start()
+    results = []
+    try:
+        for scenario in options.scenario or ['log', 'export', 'console', 'extraction']:
+            for extraction in options.extraction or [module.EXTRACTION_CALLBACK, module.EXTRACTION_NO_CALLBACK,
+                                                    module.EXTRACTION_FORMAT]:
+                measures = SCENARIOS[scenario](module, options, extraction)
+                results.append(('%s [%s]' % (scenario, extraction), measures))
+    finally:
+        if not options.keep:
+            shutil.rmtree(directory)
+    if options.json:
+        json.dump({'options': vars(options), 'results': dict(results)}, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print_results(results)
+    return 0 if all(measures.get('accurate', True) for _, measures in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
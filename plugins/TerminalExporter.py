@@ -4,13 +4,27 @@ Created on May 6, 2012
 @author: Daniel Marohn
 """
 
-from gi.repository import Gtk
+from gi.repository import Gtk, GLib, Vte
 
 import terminatorlib.plugin as plugin
 from terminatorlib.util import dbg, err
 from terminatorlib.config import Config
 import uuid
+import json
+import mmap
+import os
+import queue
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_right
+from datetime import datetime
 from os import path
+from urllib.request import pathname2url
 
 EXPORTER_NAME = 'TerminalExporter'
 
@@ -25,6 +39,44 @@ SETTING_MENU_STOP_LOG = 'stopLogMenuText'
 SETTING_MENU_START_LOG = 'logMenuText'
 SETTING_MENU_EXPORT_LOG = 'exportLogMenuText'
 SETTING_MENU_CONSOLE = 'showConsole'
+SETTING_MENU_EXPORT_WINDOW = 'exportWindowMenuText'
+SETTING_MENU_EXPORT_GROUP = 'exportGroupMenuText'
+SETTING_EXPORT_THREADS = 'exportThreads'
+SETTING_SEARCH_INDEX = 'searchIndex'
+SETTING_CONSOLE_SEARCH_ALIAS = 'consoleSearchAlias'
+SETTING_LOG_TIMESTAMPS = 'logTimestamps'
+SETTING_LOG_INDEX_INTERVAL = 'logIndexInterval'
+SETTING_CONSOLE_SEEK_ALIAS = 'consoleSeekAlias'
+SETTING_LOG_RING_BUFFER_SIZE = 'logRingBufferSize'
+SETTING_CONSOLE_RING_ALIAS = 'consoleRingAlias'
+SETTING_MENU_STATS = 'statsMenuText'
+SETTING_STATS_FILE = 'statsFile'
+SETTING_STATS_INTERVAL = 'statsInterval'
+
+COMMAND_SEARCH = 'search'
+COMMAND_SEEK = 'seek'
+COMMAND_RING = 'ring'
+
+# ways to get text out of vte, fastest first (see get_text_range)
+EXTRACTION_FORMAT = 'format'
+EXTRACTION_NO_CALLBACK = 'no-callback'
+EXTRACTION_CALLBACK = 'callback'
+
+EXPORT_EXTENSION = '.terminatorExport'
+MANIFEST_EXTENSION = '.terminatorManifest'
+TIME_INDEX_EXTENSION = '.timeIndex'
+RING_EXTENSION = '.ring'
+RING_MAGIC = b'TERMRING'
+# magic, capacity, total number of bytes ever written
+RING_HEADER = struct.Struct('<8sQQ')
+# the search index reads new content in chunks of this size
+INDEX_CHUNK_SIZE = 4 * 1024 * 1024
+SIZE_SUFFIXES = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+# '[2012-05-06 14:05:03.123] '
+TIMESTAMP_LENGTH = 23
+TIMESTAMP_PREFIX_LENGTH = TIMESTAMP_LENGTH + 3
+SEEK_TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%H:%M:%S', '%H:%M']
 
 DEFAULT_SETTINGS = {SETTING_DIR: '/tmp',
                     SETTING_EXPORT_FILE: '/tmp/.terminatorExports',
@@ -35,10 +87,23 @@ DEFAULT_SETTINGS = {SETTING_DIR: '/tmp',
                     SETTING_MENU_START_LOG: 'log terminal',
                     SETTING_MENU_EXPORT_LOG: 'export and log terminal',
                     SETTING_MENU_CONSOLE: 'show console',
+                    SETTING_MENU_EXPORT_WINDOW: 'export all in window',
+                    SETTING_MENU_EXPORT_GROUP: 'export all in group',
+                    SETTING_EXPORT_THREADS: '4',
                     SETTING_CONSOLE_ALIAS: ['tgrep="cat %s | grep"',
                                             'ttail="tail %s"',
                                             'tless="less %s"'],
                     SETTING_CONSOLE_LOGFILE_VARIABLE: 'TERMINAL_LOGFILE',
+                    SETTING_SEARCH_INDEX: '',
+                    SETTING_CONSOLE_SEARCH_ALIAS: 'tsearch',
+                    SETTING_LOG_TIMESTAMPS: 'False',
+                    SETTING_LOG_INDEX_INTERVAL: '10',
+                    SETTING_CONSOLE_SEEK_ALIAS: 'tseek',
+                    SETTING_LOG_RING_BUFFER_SIZE: '0',
+                    SETTING_CONSOLE_RING_ALIAS: 'tring',
+                    SETTING_MENU_STATS: 'stats',
+                    SETTING_STATS_FILE: '',
+                    SETTING_STATS_INTERVAL: '60',
                     }
 
 
@@ -61,18 +126,496 @@ def parse_plugin_config(config):
     return ret
 
 
+def is_enabled(value):
+    """config values are strings; interpret them as boolean"""
+    return str(value).lower() in ('true', 'yes', 'on', '1')
+
+
+def parse_size(value):
+    """parse a size like 1048576, 512K or 64M into bytes"""
+    value = str(value).strip().upper()
+    if value and value[-1] in SIZE_SUFFIXES:
+        return int(value[:-1]) * SIZE_SUFFIXES[value[-1]]
+    return int(value or 0)
+
+
+def format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime(TIMESTAMP_FORMAT)[:TIMESTAMP_LENGTH]
+
+
+def parse_timestamp(line):
+    """
+    Get the timestamp of a line, written in timestamp mode.
+    @return: seconds since epoch or None, if line has no timestamp
+    """
+    if len(line) < TIMESTAMP_PREFIX_LENGTH or line[0:1] != b'[':
+        return None
+    try:
+        text = line[1:TIMESTAMP_LENGTH + 1].decode('ascii')
+        return datetime.strptime(text, TIMESTAMP_FORMAT).timestamp()
+    except ValueError:
+        return None
+
+
+def extract_text_range(vte, start_row, end_row, end_column, extraction):
+    """
+    Get text of vte between start_row and end_row.
+    @param extraction: one of EXTRACTION_*;
+    format and no-callback avoid calling back into python for every cell
+    @return: the text
+    """
+    if extraction == EXTRACTION_FORMAT:
+        content = vte.get_text_range_format(Vte.Format.TEXT, start_row, 0, end_row, end_column)
+    elif extraction == EXTRACTION_NO_CALLBACK:
+        content = vte.get_text_range(start_row, 0, end_row, end_column, None, None)
+    else:
+        content = vte.get_text_range(start_row, 0, end_row, end_column,
+                                     lambda widget, col, row, junk: True)
+    # newer bindings return (text, attributes) or (text, length)
+    if isinstance(content, tuple):
+        content = content[0]
+    return content or ''
+
+
+def detect_text_extraction(vte, start_row, end_row, end_column):
+    """
+    Find the fastest way of text extraction, the installed vte provides.
+    @return: (extraction, text between start_row and end_row)
+    """
+    if hasattr(vte, 'get_text_range_format') and hasattr(Vte, 'Format'):
+        try:
+            return EXTRACTION_FORMAT, extract_text_range(vte, start_row, end_row, end_column, EXTRACTION_FORMAT)
+        except (TypeError, AttributeError):
+            pass
+    try:
+        return EXTRACTION_NO_CALLBACK, extract_text_range(vte, start_row, end_row, end_column, EXTRACTION_NO_CALLBACK)
+    except TypeError:
+        # is_selected callback is not nullable in this vte
+        return EXTRACTION_CALLBACK, extract_text_range(vte, start_row, end_row, end_column, EXTRACTION_CALLBACK)
+
+
+def open_search_index(plugin_config):
+    """
+    Open the search index, configured by plugin_config, for reading;
+    only IndexWorker writes to the index.
+    @return: SearchIndex instance or None, if disabled or not available.
+    """
+    if not plugin_config[SETTING_SEARCH_INDEX]:
+        return None
+    filename = path.join(plugin_config[SETTING_DIR], plugin_config[SETTING_SEARCH_INDEX])
+    try:
+        return SearchIndex(filename, readonly=True)
+    except sqlite3.Error as ex:
+        err('search index [%s] not available: %s' % (filename, ex))
+        return None
+
+
+class IndexWorker(threading.Thread):
+    """
+    Background thread, that owns the search index; it is the only writer.
+    On start, all files listed in export_file are synced. After that the
+    logging and export paths only queue file names; queued files are synced
+    in batches, so the ui thread never waits for sqlite.
+    """
+
+    def __init__(self, filename, export_file):
+        """
+        @param filename: the sqlite database (see SearchIndex)
+        @param export_file: file names of past exports (see exportNameToFile)
+        """
+        super(IndexWorker, self).__init__(name='%s index' % EXPORTER_NAME)
+        self.daemon = True
+        self.filename = filename
+        self.export_file = export_file
+        self.queue = queue.Queue()
+
+    def add(self, filename, reset=False):
+        """
+        Queue filename for indexing.
+        @param reset: drop what is indexed for filename first (file was rewritten)
+        """
+        self.queue.put((filename, reset))
+
+    def run(self):
+        try:
+            index = SearchIndex(self.filename)
+        except sqlite3.Error as ex:
+            err('search index [%s] not available: %s' % (self.filename, ex))
+            return
+        try:
+            index.sync_exports(self.export_file)
+        except (sqlite3.Error, IOError, OSError) as ex:
+            err('failed to index past exports: %s' % ex)
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            filenames = []
+            for filename, reset in batch:
+                if reset:
+                    index.forget(filename)
+                if filename not in filenames:
+                    filenames.append(filename)
+            for filename in filenames:
+                try:
+                    index.sync(filename)
+                except sqlite3.Error as ex:
+                    err('failed to index [%s]: %s' % (filename, ex))
+
+
+def start_index_worker(plugin_config):
+    """
+    Start the index worker, if the search index is configured.
+    @return: IndexWorker instance or None, if disabled.
+    """
+    if not plugin_config[SETTING_SEARCH_INDEX]:
+        return None
+    worker = IndexWorker(path.join(plugin_config[SETTING_DIR], plugin_config[SETTING_SEARCH_INDEX]),
+                         plugin_config[SETTING_EXPORT_FILE])
+    worker.start()
+    return worker
+
+
+class SearchIndex:
+    """
+    Incremental full text index (sqlite fts5) over exported and logged files.
+    For every file we remember the byte offset up to which it is indexed,
+    so only new content is read on the next sync.
+    Not thread safe; the plugin uses it from IndexWorker's thread only.
+    """
+
+    def __init__(self, filename, readonly=False):
+        """
+        @param filename: the sqlite database; created if not existing
+        @param readonly: open an existing database for search only
+        """
+        self.filename = filename
+        if readonly:
+            self.connection = sqlite3.connect('file:%s?mode=ro' % pathname2url(filename), uri=True, timeout=10)
+            return
+        self.connection = sqlite3.connect(filename, timeout=10)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS files '
+                                '(filename TEXT PRIMARY KEY, offset INTEGER, lines INTEGER)')
+        self.connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS content '
+                                'USING fts5(filename UNINDEXED, line UNINDEXED, text)')
+        self.connection.commit()
+
+    def sync(self, filename):
+        """
+        Index all complete lines of filename, that are not indexed yet.
+        A file, that became smaller than its indexed offset, is indexed again.
+        Content is read and committed in chunks of INDEX_CHUNK_SIZE, ending on a
+        line break; lines longer than a chunk are indexed in pieces.
+        @return: number of lines added to the index
+        """
+        row = self.connection.execute('SELECT offset, lines FROM files WHERE filename = ?',
+                                      (filename,)).fetchone()
+        offset, lines = row if row else (0, 0)
+        try:
+            size = path.getsize(filename)
+        except OSError:
+            return 0
+        if size < offset:
+            self.connection.execute('DELETE FROM content WHERE filename = ?', (filename,))
+            offset, lines = 0, 0
+        added = 0
+        with open(filename, 'rb') as input_file:
+            while offset < size:
+                input_file.seek(offset)
+                data = input_file.read(min(INDEX_CHUNK_SIZE, size - offset))
+                end = data.rfind(b'\n') + 1
+                if end:
+                    new_lines = data[:end].decode('utf-8', 'replace').split('\n')[:-1]
+                elif len(data) < INDEX_CHUNK_SIZE:
+                    # incomplete last line; indexed, when it is complete
+                    break
+                else:
+                    # piece of a line, longer than a chunk; keeps the line's number
+                    end = len(data)
+                    new_lines = []
+                    self.connection.execute('INSERT INTO content (filename, line, text) VALUES (?, ?, ?)',
+                                            (filename, lines + 1, data.decode('utf-8', 'replace')))
+                self.connection.executemany('INSERT INTO content (filename, line, text) VALUES (?, ?, ?)',
+                                            [(filename, lines + number, text)
+                                             for number, text in enumerate(new_lines, 1) if text.strip()])
+                offset += end
+                lines += len(new_lines)
+                added += len(new_lines)
+                self.connection.execute('INSERT OR REPLACE INTO files (filename, offset, lines) '
+                                        'VALUES (?, ?, ?)', (filename, offset, lines))
+                self.connection.commit()
+        return added
+
+    def sync_exports(self, export_file):
+        """
+        Sync every file, listed in export_file (see exportNameToFile).
+        """
+        if not export_file or not path.isfile(export_file):
+            return
+        with open(export_file) as input_file:
+            filenames = [line.strip() for line in input_file if line.strip()]
+        for filename in sorted(set(filenames)):
+            self.sync(filename)
+
+    def forget(self, filename):
+        """
+        Remove filename from the index; used if a file is rewritten.
+        """
+        self.connection.execute('DELETE FROM content WHERE filename = ?', (filename,))
+        self.connection.execute('DELETE FROM files WHERE filename = ?', (filename,))
+        self.connection.commit()
+
+    def search(self, query):
+        """
+        Search the index.
+        @param query: fts5 query; used as phrase, if it is not a valid query
+        @return: list of (filename, line number, text)
+        """
+        statement = 'SELECT filename, line, text FROM content WHERE content MATCH ? ORDER BY filename, line'
+        try:
+            return self.connection.execute(statement, (query,)).fetchall()
+        except sqlite3.OperationalError:
+            phrase = '"%s"' % query.replace('"', '""')
+            return self.connection.execute(statement, (phrase,)).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+class RingBuffer:
+    """
+    Fixed size, preallocated and memory mapped log file; new content
+    overwrites the oldest. The file starts with RING_HEADER, followed by
+    capacity bytes of data. Write position is the number of bytes ever
+    written modulo capacity.
+    If a ring is garbage collected without close (its terminal vanished
+    without destroy or child-exited), map and file descriptor are closed
+    anyway; the ring file stays and can be read with the ring helper.
+    """
+
+    def __init__(self, filename, capacity):
+        """
+        @param filename: the ring file; created (or overwritten)
+        @param capacity: number of data bytes, kept in the ring
+        """
+        self.filename = filename
+        self.capacity = capacity
+        self.written = 0
+        size = RING_HEADER.size + capacity
+        self.fd = os.open(filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(self.fd, 0, size)
+            else:
+                os.ftruncate(self.fd, size)
+            self.map = mmap.mmap(self.fd, size)
+        except (OSError, ValueError):
+            os.close(self.fd)
+            raise
+        self.finalizer = weakref.finalize(self, close_ring_map, self.map, self.fd)
+        self.write_header()
+
+    def write_header(self):
+        self.map[:RING_HEADER.size] = RING_HEADER.pack(RING_MAGIC, self.capacity, self.written)
+
+    def write(self, data):
+        """
+        Append data; only the last capacity bytes are kept.
+        """
+        skipped = max(0, len(data) - self.capacity)
+        data = data[skipped:]
+        position = (self.written + skipped) % self.capacity
+        first = min(len(data), self.capacity - position)
+        start = RING_HEADER.size + position
+        self.map[start:start + first] = data[:first]
+        if first < len(data):
+            self.map[RING_HEADER.size:RING_HEADER.size + len(data) - first] = data[first:]
+        self.written += skipped + len(data)
+        self.write_header()
+
+    def linearise(self):
+        """
+        @return: content of the ring, oldest byte first
+        """
+        return linearise_ring(self.map[RING_HEADER.size:], self.capacity, self.written)
+
+    def close(self, remove=False):
+        self.finalizer()
+        if remove:
+            os.remove(self.filename)
+
+
+def close_ring_map(ring_map, fd):
+    """finalizer of RingBuffer; must not reference the ring itself"""
+    ring_map.close()
+    os.close(fd)
+
+
+def linearise_ring(data, capacity, written):
+    """
+    Order ring data oldest first. After the ring wrapped, the oldest line is
+    most likely incomplete and skipped.
+    """
+    if written <= capacity:
+        return data[:written]
+    position = written % capacity
+    data = data[position:capacity] + data[:position]
+    return data[data.find(b'\n') + 1:]
+
+
+def read_ring_file(filename):
+    """
+    Linearise a ring file without mapping it (see RingBuffer).
+    """
+    with open(filename, 'rb') as input_file:
+        magic, capacity, written = RING_HEADER.unpack(input_file.read(RING_HEADER.size))
+        if magic != RING_MAGIC:
+            raise ValueError('[%s] is not a ring file' % filename)
+        return linearise_ring(input_file.read(capacity), capacity, written)
+
+
+class Histogram:
+    """Timing histogram; bucket n counts durations up to 2^n microseconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        bucket = int(seconds * 1000000).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {'count': self.count,
+                'total': self.total,
+                'mean': self.mean(),
+                'max': self.max,
+                'buckets_us': dict(('<=%d' % 2 ** bucket, count)
+                                   for bucket, count in sorted(self.buckets.items()))}
+
+    def summary(self):
+        return '%d calls, mean %.2f ms, max %.2f ms' % (self.count, self.mean() * 1000, self.max * 1000)
+
+
+class LogStats:
+    """Counters and timings of logging and exporting"""
+
+    def __init__(self):
+        self.signals = 0
+        self.logged_bytes = 0
+        self.exports = 0
+        self.exported_bytes = 0
+        self.notify = Histogram()
+        self.text_range = Histogram()
+
+    def add_signal(self, logged_bytes, seconds):
+        """one contents-changed signal, handled by log_notify"""
+        self.signals += 1
+        self.logged_bytes += logged_bytes
+        self.notify.add(seconds)
+
+    def add_export(self, exported_bytes):
+        self.exports += 1
+        self.exported_bytes += exported_bytes
+
+    def to_dict(self):
+        return {'signals': self.signals,
+                'logged_bytes': self.logged_bytes,
+                'exports': self.exports,
+                'exported_bytes': self.exported_bytes,
+                'log_notify': self.notify.to_dict(),
+                'get_text_range': self.text_range.to_dict()}
+
+    def summary(self):
+        """@return: list of lines, shown in stats menu"""
+        return ['signals: %d, logged: %.1f KB' % (self.signals, self.logged_bytes / 1024.0),
+                'exports: %d, exported: %.1f KB' % (self.exports, self.exported_bytes / 1024.0),
+                'log_notify: %s' % self.notify.summary(),
+                'get_text_range: %s' % self.text_range.summary()]
+
+
 class LogParameter:
     """Container class, holding information about a logged terminal"""
 
-    def __init__(self, watcher, filename, last_logged_line=-1):
+    def __init__(self, watcher, filename, last_logged_line=-1, timestamps=False):
         """
         @param watcher: the gtk object, returned by vte.connect
         @param filename: terminal output is logged into this file
         @param last_logged_line: number of last line number that was written to file
+        @param timestamps: prefix logged lines with a timestamp and maintain a time index
         """
         self.watcher = watcher
+        # terminator may drop terminal's vte before our handlers run
+        self.vte_ref = None
+        self.stats = LogStats()
+        self.ring = None
+        self.exit_watcher = None
+        self.destroy_watcher = None
         self.last_logged_line = last_logged_line
         self.filename = filename
+        self.timestamps = timestamps
+        self.last_timestamp = 0
+        self.last_indexed_timestamp = 0
+        # the last chunk ended with a line break; the next one starts a new line
+        self.at_line_start = True
+
+    def next_timestamp(self):
+        """current time, but never earlier than the previous one"""
+        self.last_timestamp = max(time.time(), self.last_timestamp)
+        return self.last_timestamp
+
+    def add_timestamps(self, content):
+        """
+        @return: (timestamp, content with timestamp in front of every line)
+        A chunk, continuing the unfinished last line of the previous chunk,
+        gets no timestamp in front of that continuation.
+        """
+        timestamp = self.next_timestamp()
+        prefix = '[%s] ' % format_timestamp(timestamp)
+        parts = content.split('\n')
+        lines = [part + '\n' for part in parts[:-1]]
+        if parts[-1]:
+            lines.append(parts[-1])
+        result = []
+        for line in lines:
+            result.append(prefix + line if self.at_line_start else line)
+            self.at_line_start = line.endswith('\n')
+        return timestamp, ''.join(result)
+
+
+class ExportParameter:
+    """Container class, holding the captured content of a terminal for bulk export"""
+
+    def __init__(self, filename, content, caption, group, cwd):
+        """
+        @param filename: content is written into this file
+        @param content: terminal content (utf-8), captured on ui thread
+        @param caption, group, cwd: terminal's properties, written to the manifest
+        """
+        self.filename = filename
+        self.content = content
+        self.caption = caption
+        self.group = group
+        self.cwd = cwd
+
+    def manifest_entry(self):
+        return {'file': self.filename,
+                'caption': self.caption,
+                'group': self.group,
+                'cwd': self.cwd}
 
 
 class TerminalExporter(plugin.MenuItem):
@@ -87,8 +630,17 @@ class TerminalExporter(plugin.MenuItem):
         super(TerminalExporter, self).__init__()
         self.config = Config()
         self.plugin_config = parse_plugin_config(self.config)
-        self.logging_terminals = {}
+        # weak keys: a closed terminal must not be kept alive by its log
+        self.logging_terminals = weakref.WeakKeyDictionary()
+        self.index = start_index_worker(self.plugin_config)
         self.scrollback_lines = self.config['scrollback_lines']
+        self.stats = LogStats()
+        self.last_written_stats = None
+        # detected on first use
+        self.text_extraction = None
+        stats_interval = int(self.plugin_config[SETTING_STATS_INTERVAL])
+        if self.plugin_config[SETTING_STATS_FILE] and stats_interval > 0:
+            GLib.timeout_add_seconds(stats_interval, self.write_stats)
         dbg('using config: %s' % self.plugin_config)
 
     def callback(self, menuitems, menu, terminal):
@@ -98,6 +650,13 @@ class TerminalExporter(plugin.MenuItem):
         export_item = Gtk.MenuItem(self.plugin_config[SETTING_MENU_EXPORT])
         export_item.connect('activate', self.do_export, terminal)
         submenu.append(export_item)
+        export_item = Gtk.MenuItem(self.plugin_config[SETTING_MENU_EXPORT_WINDOW])
+        export_item.connect('activate', self.do_export_window, terminal)
+        submenu.append(export_item)
+        if terminal.group:
+            export_item = Gtk.MenuItem(self.plugin_config[SETTING_MENU_EXPORT_GROUP])
+            export_item.connect('activate', self.do_export_group, terminal)
+            submenu.append(export_item)
         if terminal in self.logging_terminals:
             log_item = Gtk.MenuItem(self.plugin_config[SETTING_MENU_STOP_LOG])
             log_item.connect('activate', self.do_stop_log, terminal)
@@ -112,9 +671,53 @@ class TerminalExporter(plugin.MenuItem):
         console_item = Gtk.MenuItem(self.plugin_config[SETTING_MENU_CONSOLE])
         console_item.connect('activate', self.do_console, terminal)
         submenu.append(console_item)
+        submenu.append(self.create_stats_item(terminal))
         item.set_submenu(submenu)
         menuitems.append(item)
 
+    def create_stats_item(self, terminal):
+        """
+        Create the 'stats' menu item; its sub menu shows global counters
+        and the counters of terminal's log.
+        """
+        lines = ['logged terminals: %d' % self.get_logging_count(),
+                 'text extraction: %s' % self.text_extraction] + self.stats.summary()
+        if terminal in self.logging_terminals:
+            lines += [None, 'this terminal:'] + self.logging_terminals[terminal].stats.summary()
+        stats_item = Gtk.MenuItem(self.plugin_config[SETTING_MENU_STATS])
+        stats_menu = Gtk.Menu()
+        for line in lines:
+            if line is None:
+                stats_menu.append(Gtk.SeparatorMenuItem())
+            else:
+                line_item = Gtk.MenuItem(line)
+                line_item.set_sensitive(False)
+                stats_menu.append(line_item)
+        stats_item.set_submenu(stats_menu)
+        return stats_item
+
+    def write_stats(self):
+        """
+        Append current stats as json line to the stats file, if anything
+        changed since last time. Called periodically by GLib.
+        """
+        current = (self.stats.signals, self.stats.exports, self.get_logging_count())
+        if current != self.last_written_stats:
+            record = {'time': datetime.now().isoformat(),
+                      'logged_terminals': self.get_logging_count(),
+                      'text_extraction': self.text_extraction,
+                      'global': self.stats.to_dict(),
+                      'terminals': dict((parameter.filename, parameter.stats.to_dict())
+                                        for parameter in self.logging_terminals.values())}
+            filename = path.join(self.plugin_config[SETTING_DIR], self.plugin_config[SETTING_STATS_FILE])
+            try:
+                with open(filename, "a") as output_file:
+                    output_file.write(json.dumps(record) + '\n')
+            except (IOError, OSError) as ex:
+                err('failed to write stats to [%s]: %s' % (filename, ex))
+            self.last_written_stats = current
+        return True
+
     def do_export_log(self, widget, terminal):
         filename = self.do_export(widget, terminal)
         self.do_log(widget, terminal, filename)
@@ -124,35 +727,219 @@ class TerminalExporter(plugin.MenuItem):
         """
         Export complete terminal content into file.
         """
-        vte = terminal.get_vte()
-        (start_row, end_row, end_column) = self.get_vte_buffer_range(vte)
-        content = vte.get_text_range(start_row, 0, end_row, end_column,
-                                     lambda widget, col, row, junk: True)
+        data = self.get_content(terminal).encode('utf-8')
+        self.stats.add_export(len(data))
         filename = self.get_filename()
-        with open(filename, "w") as output_file:
-            output_file.writelines(str(content))
-            output_file.close()
+        with open(filename, "wb") as output_file:
+            output_file.write(data)
         dbg('terminal content written to [%s]' % filename)
+        self.update_index(filename)
+        self.feed_export_env(terminal, filename)
+        return filename
+
+    def do_export_window(self, _, terminal):
+        """
+        Export all terminals of terminal's window.
+        """
+        window = terminal.get_toplevel()
+        return self.export_all([other for other in terminal.terminator.terminals
+                                if other.get_toplevel() == window])
+
+    def do_export_group(self, _, terminal):
+        """
+        Export all terminals of terminal's group.
+        """
+        return self.export_all([other for other in terminal.terminator.terminals
+                                if other.group == terminal.group])
+
+    def export_all(self, terminals):
+        """
+        Capture the content of all terminals in one pass (vte must be accessed
+        from ui thread) and write files plus manifest in background.
+        Unlike do_export, nothing is fed to the terminals (exportNameToEnv);
+        the manifest ties every file to its terminal.
+        @return: the background thread
+        """
+        exports = []
+        for terminal in terminals:
+            filename = self.get_filename()
+            data = self.get_content(terminal).encode('utf-8')
+            self.stats.add_export(len(data))
+            exports.append(ExportParameter(filename, data,
+                                           self.get_caption(terminal),
+                                           terminal.group, terminal.get_cwd()))
+        manifest = path.join(self.plugin_config[SETTING_DIR], uuid.uuid1().__str__() + MANIFEST_EXTENSION)
+        writer = threading.Thread(target=self.write_exports, args=(exports, manifest))
+        writer.daemon = True
+        writer.start()
+        return writer
+
+    def write_exports(self, exports, manifest):
+        """
+        Write captured exports in parallel, followed by the manifest,
+        that ties every written file to its terminal.
+        """
+        try:
+            threads = int(self.plugin_config[SETTING_EXPORT_THREADS])
+        except ValueError as ex:
+            err('invalid %s: %s' % (SETTING_EXPORT_THREADS, ex))
+            threads = 1
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+            written = [export for export, ok in zip(exports, executor.map(self.write_export, exports)) if ok]
+        try:
+            with open(manifest, "w") as output_file:
+                json.dump({'created': datetime.now().isoformat(),
+                           'terminals': [export.manifest_entry() for export in written]},
+                          output_file, indent=2)
+        except (IOError, OSError) as ex:
+            err('failed to write manifest [%s]: %s' % (manifest, ex))
+            return
+        dbg('%d of %d terminals exported; manifest written to [%s]' % (len(written), len(exports), manifest))
+
+    def write_export(self, export):
+        """
+        @return: True, if export was written
+        """
+        try:
+            with open(export.filename, "wb") as output_file:
+                output_file.write(export.content)
+        except (IOError, OSError) as ex:
+            err('failed to export [%s]: %s' % (export.filename, ex))
+            return False
+        export.content = None
+        self.update_index(export.filename)
+        return True
+
+    def get_content(self, terminal):
+        """
+        Get complete terminal content.
+        """
+        vte = terminal.get_vte()
+        (start_row, end_row, end_column) = self.get_vte_buffer_range(vte)
+        return self.get_text_range(vte, start_row, end_row, end_column)
+
+    def get_text_range(self, vte, start_row, end_row, end_column, stats=None):
+        """
+        Get text of vte between start_row and end_row; time is recorded in
+        global stats and, if given, in stats.
+        """
+        started = time.perf_counter()
+        if self.text_extraction is None:
+            self.text_extraction, content = detect_text_extraction(vte, start_row, end_row, end_column)
+            dbg('using text extraction: %s' % self.text_extraction)
+        else:
+            content = extract_text_range(vte, start_row, end_row, end_column, self.text_extraction)
+        duration = time.perf_counter() - started
+        self.stats.text_range.add(duration)
+        if stats:
+            stats.text_range.add(duration)
+        return content
+
+    @staticmethod
+    def get_caption(terminal):
+        """
+        The caption, shown in terminal's titlebar: the custom one, if the
+        user renamed the terminal, vte's window title otherwise.
+        """
+        return terminal.titlebar.get_custom_string() or terminal.get_vte().get_window_title()
+
+    def feed_export_env(self, terminal, filename):
         if self.plugin_config[SETTING_EXPORT_ENV] != '':
             terminal.feed('%s="%s"\n' % (self.plugin_config[SETTING_EXPORT_ENV], filename))
-        return filename
 
     def do_log(self, _, terminal, filename=None):
         if filename is None:
             filename = self.get_filename()
         vte = terminal.get_vte()
         (start_row, end_row, end_column) = self.get_vte_buffer_range(vte)
-        watcher = vte.connect('contents-changed', self.log_notify, terminal)
-        parameter = LogParameter(watcher, filename, end_row)
+        terminal_ref = weakref.ref(terminal)
+        watcher = vte.connect('contents-changed', self.log_notify, terminal_ref)
+        parameter = LogParameter(watcher, filename, end_row,
+                                 is_enabled(self.plugin_config[SETTING_LOG_TIMESTAMPS]))
+        parameter.vte_ref = weakref.ref(vte)
+        ring_size = parse_size(self.plugin_config[SETTING_LOG_RING_BUFFER_SIZE])
+        if ring_size > 0:
+            parameter.ring = self.create_ring(filename, ring_size)
+        parameter.exit_watcher = vte.connect('child-exited', self.log_exited, terminal_ref)
+        parameter.destroy_watcher = terminal.connect('destroy', self.log_destroyed, terminal_ref)
         self.logging_terminals[terminal] = parameter
+        dbg('logging [%s]; %d terminals logged' % (filename, self.get_logging_count()))
 
     def do_stop_log(self, _, terminal):
-        vte = terminal.get_vte()
-        vte.disconnect(self.logging_terminals.pop(terminal).watcher)
+        self.stop_log(terminal)
+
+    def log_exited(self, vte, _, terminal_ref):
+        """
+        Terminal's child exited; vte is still alive, so log what is left.
+        """
+        terminal = terminal_ref()
+        if terminal in self.logging_terminals:
+            if vte is not None:
+                self.log_notify(vte, terminal_ref)
+            self.stop_log(terminal)
+
+    def log_destroyed(self, _, terminal_ref):
+        """
+        Terminal is destroyed; vte's content may be gone, so just stop.
+        """
+        terminal = terminal_ref()
+        if terminal in self.logging_terminals:
+            self.stop_log(terminal)
+
+    def stop_log(self, terminal):
+        """
+        Disconnect all handlers of a logged terminal and flush its index.
+        """
+        parameter = self.logging_terminals.pop(terminal)
+        if parameter.ring:
+            self.write_ring(parameter)
+            parameter.ring.close(remove=True)
+        vte = parameter.vte_ref()
+        if vte is not None:
+            for watcher in (parameter.watcher, parameter.exit_watcher):
+                if vte.handler_is_connected(watcher):
+                    vte.disconnect(watcher)
+        if terminal.handler_is_connected(parameter.destroy_watcher):
+            terminal.disconnect(parameter.destroy_watcher)
+        self.update_index(parameter.filename)
+        dbg('stopped logging [%s]; %d terminals logged' % (parameter.filename, self.get_logging_count()))
+
+    def get_logging_count(self):
+        """
+        @return: number of currently logged terminals
+        """
+        return len(self.logging_terminals)
+
+    def create_ring(self, filename, size):
+        """
+        Create the ring buffer for a log; content, already exported into
+        filename (see export and log), is kept in the ring.
+        @return: RingBuffer instance or None, if ring could not be created
+        """
+        try:
+            ring = RingBuffer(filename + RING_EXTENSION, size)
+        except (OSError, ValueError) as ex:
+            err('failed to create ring buffer for [%s]: %s' % (filename, ex))
+            return None
+        if path.isfile(filename):
+            with open(filename, 'rb') as input_file:
+                ring.write(input_file.read())
+        return ring
+
+    def write_ring(self, parameter):
+        """
+        Write ring's content, oldest first, into the log file.
+        """
+        with open(parameter.filename, 'wb') as output_file:
+            output_file.write(parameter.ring.linearise())
+        self.update_index(parameter.filename, reset=True)
 
     def do_console(self, widget, terminal):
         if terminal in self.logging_terminals:
-            filename = self.logging_terminals[terminal].filename
+            parameter = self.logging_terminals[terminal]
+            filename = parameter.filename
+            if parameter.ring:
+                self.write_ring(parameter)
         else:
             filename = self.do_export_log(widget, terminal)
         terminal.get_parent().split_axis(terminal, True)
@@ -163,18 +950,72 @@ class TerminalExporter(plugin.MenuItem):
         variable_name = self.plugin_config[SETTING_CONSOLE_LOGFILE_VARIABLE]
         if variable_name:
             new_terminal.feed('export %s=%s\n' % (variable_name, filename))
+        search_alias = self.plugin_config[SETTING_CONSOLE_SEARCH_ALIAS]
+        if search_alias and self.index:
+            new_terminal.feed('alias %s=\'%s\'\n' % (search_alias, get_helper_command(COMMAND_SEARCH)))
+        seek_alias = self.plugin_config[SETTING_CONSOLE_SEEK_ALIAS]
+        parameter = self.logging_terminals[terminal]
+        if seek_alias and parameter.timestamps and not parameter.ring:
+            new_terminal.feed('alias %s=\'%s "%s"\'\n' % (seek_alias, get_helper_command(COMMAND_SEEK), filename))
+        ring_alias = self.plugin_config[SETTING_CONSOLE_RING_ALIAS]
+        if ring_alias and parameter.ring:
+            new_terminal.feed('alias %s=\'%s "%s"\'\n' % (ring_alias, get_helper_command(COMMAND_RING),
+                                                          parameter.ring.filename))
 
-    def log_notify(self, _, terminal):
-        vte = terminal.get_vte()
+    def log_notify(self, vte, terminal_ref):
+        """
+        Called on vte's contents-changed; log new lines.
+        @param vte: the signal's vte; terminal.get_vte() may already be gone
+        """
+        terminal = terminal_ref()
+        parameter = self.logging_terminals.get(terminal) if terminal else None
+        if parameter is None or vte is None:
+            return
+        started = time.perf_counter()
+        logged_bytes = 0
         (start_row, end_row, end_column) = self.get_vte_buffer_range(vte)
-        parameter = self.logging_terminals[terminal]
         if end_row > parameter.last_logged_line:
-            content = vte.get_text_range(parameter.last_logged_line, 0, end_row, end_column,
-                                         lambda widget, col, row, junk: True)
-            with open(parameter.filename, "a") as output_file:
-                output_file.writelines(content)
-                output_file.close()
+            content = self.get_text_range(vte, parameter.last_logged_line, end_row, end_column, parameter.stats)
+            if parameter.timestamps:
+                timestamp, content = parameter.add_timestamps(content)
+            data = content.encode('utf-8')
+            if parameter.ring:
+                parameter.ring.write(data)
+            elif parameter.timestamps:
+                self.write_timestamped_log(parameter, timestamp, data)
+            else:
+                with open(parameter.filename, "ab") as output_file:
+                    output_file.write(data)
             parameter.last_logged_line = end_row
+            logged_bytes = len(data)
+            if not parameter.ring:
+                self.update_index(parameter.filename)
+        duration = time.perf_counter() - started
+        self.stats.add_signal(logged_bytes, duration)
+        parameter.stats.add_signal(logged_bytes, duration)
+
+    def write_timestamped_log(self, parameter, timestamp, data):
+        """
+        Write data, that has a timestamp in front of every line.
+        Every logIndexInterval seconds, the byte offset of the chunk is added to
+        the time index (filename plus .timeIndex), so a time range can be found
+        with a single seek (see seek_command).
+        """
+        with open(parameter.filename, "ab") as output_file:
+            offset = output_file.tell()
+            output_file.write(data)
+        interval = float(self.plugin_config[SETTING_LOG_INDEX_INTERVAL])
+        if timestamp - parameter.last_indexed_timestamp >= interval:
+            with open(parameter.filename + TIME_INDEX_EXTENSION, "a") as index_file:
+                index_file.write('%f %d\n' % (timestamp, offset))
+            parameter.last_indexed_timestamp = timestamp
+
+    def update_index(self, filename, reset=False):
+        """
+        Queue filename for the search index (if enabled); see IndexWorker.
+        """
+        if self.index:
+            self.index.add(filename, reset)
 
     def get_vte_buffer_range(self, vte):
         """
@@ -189,10 +1030,168 @@ class TerminalExporter(plugin.MenuItem):
 
     def get_filename(self):
         filename = path.join(self.plugin_config[SETTING_DIR], uuid.uuid1().__str__())
-        ret = '%s.terminatorExport' % filename
+        ret = filename + EXPORT_EXTENSION
         if self.plugin_config[SETTING_EXPORT_FILE]:
             with open(self.plugin_config[SETTING_EXPORT_FILE], "a") as targetFile:
                 targetFile.writelines(ret + "\n")
                 targetFile.close()
 
         return ret
+
+
+def get_helper_command(command):
+    """
+    Shell command, that runs one of our command line helpers (see main).
+    """
+    return '"%s" "%s" %s' % (sys.executable, path.abspath(__file__), command)
+
+
+def search_command(arguments):
+    """
+    Search all exports and logs, indexed by terminator's IndexWorker.
+    The helper only reads the index, so it answers without rescanning files.
+    Output format is like grep's: filename:line:text
+    """
+    if not arguments:
+        sys.stderr.write('usage: %s QUERY\n' % COMMAND_SEARCH)
+        return 2
+    plugin_config = parse_plugin_config(Config())
+    index = open_search_index(plugin_config)
+    if not index:
+        sys.stderr.write('search index is disabled or not available\n')
+        return 1
+    try:
+        matches = index.search(' '.join(arguments))
+    except sqlite3.Error as ex:
+        sys.stderr.write('search failed: %s\n' % ex)
+        return 1
+    finally:
+        index.close()
+    for filename, line, text in matches:
+        sys.stdout.write('%s:%d:%s\n' % (filename, line, text))
+    return 0 if matches else 1
+
+
+def read_time_index(filename):
+    """
+    @return: list of (timestamp, byte offset), written by write_timestamped_log
+    """
+    entries = []
+    with open(filename + TIME_INDEX_EXTENSION) as index_file:
+        for line in index_file:
+            timestamp, offset = line.split()
+            entries.append((float(timestamp), int(offset)))
+    return entries
+
+
+def read_last_timestamp(filename, entries):
+    """
+    Get the timestamp of the last logged line. The time index is sparse, so
+    lines after the last index entry are scanned (at most logIndexInterval
+    seconds of output).
+    """
+    last_timestamp = entries[-1][0]
+    with open(filename, 'rb') as input_file:
+        input_file.seek(entries[-1][1])
+        for line in input_file:
+            last_timestamp = parse_timestamp(line) or last_timestamp
+    return last_timestamp
+
+
+def parse_seek_time(text, reference):
+    """
+    Parse a time given to the seek command. Times without date refer to the
+    latest such time, not after reference (the last logged timestamp).
+    """
+    for time_format in SEEK_TIME_FORMATS:
+        try:
+            parsed = datetime.strptime(text, time_format)
+        except ValueError:
+            continue
+        if '%Y' in time_format:
+            return parsed.timestamp()
+        day = datetime.fromtimestamp(reference)
+        timestamp = day.replace(hour=parsed.hour, minute=parsed.minute,
+                                second=parsed.second, microsecond=0).timestamp()
+        if timestamp > reference:
+            timestamp -= 24 * 60 * 60
+        return timestamp
+    raise ValueError('invalid time [%s]; use one of %s' % (text, ', '.join(SEEK_TIME_FORMATS)))
+
+
+def seek_command(arguments):
+    """
+    Print lines of a timestamped log between two times.
+    usage: seek LOGFILE FROM [TO]
+    """
+    if len(arguments) not in (2, 3):
+        sys.stderr.write('usage: %s LOGFILE FROM [TO]\n' % COMMAND_SEEK)
+        return 2
+    filename = arguments[0]
+    try:
+        entries = read_time_index(filename)
+    except (IOError, OSError, ValueError) as ex:
+        sys.stderr.write('no time index for [%s]: %s\n' % (filename, ex))
+        return 1
+    if not entries:
+        return 1
+    try:
+        start = parse_seek_time(arguments[1], read_last_timestamp(filename, entries))
+        # a time without date, given as end, refers to the first such time after start
+        end = parse_seek_time(arguments[2], start + 24 * 60 * 60 - 1) if len(arguments) == 3 else float('inf')
+    except ValueError as ex:
+        sys.stderr.write('%s\n' % ex)
+        return 2
+    position = bisect_right([timestamp for timestamp, _ in entries], start) - 1
+    offset = entries[position][1] if position >= 0 else 0
+    found = False
+    with open(filename, 'rb') as input_file:
+        input_file.seek(offset)
+        line_time = None
+        for line in input_file:
+            line_time = parse_timestamp(line) or line_time
+            if line_time is None or line_time < start:
+                continue
+            if line_time > end:
+                break
+            sys.stdout.buffer.write(line)
+            found = True
+    return 0 if found else 1
+
+
+def ring_command(arguments):
+    """
+    Print content of a ring buffer log, oldest first.
+    usage: ring RINGFILE
+    """
+    if len(arguments) != 1:
+        sys.stderr.write('usage: %s RINGFILE\n' % COMMAND_RING)
+        return 2
+    try:
+        content = read_ring_file(arguments[0])
+    except (IOError, OSError, ValueError, struct.error) as ex:
+        sys.stderr.write('%s\n' % ex)
+        return 1
+    sys.stdout.buffer.write(content)
+    return 0
+
+
+COMMANDS = {COMMAND_SEARCH: search_command,
+            COMMAND_SEEK: seek_command,
+            COMMAND_RING: ring_command,
+            }
+
+
+def main(argv):
+    """
+    Command line helpers, used by the aliases of 'show console'.
+    usage: TerminalExporter.py COMMAND [ARGUMENTS]
+    """
+    if len(argv) < 2 or argv[1] not in COMMANDS:
+        sys.stderr.write('usage: %s {%s} [ARGUMENTS]\n' % (path.basename(argv[0]), ','.join(sorted(COMMANDS))))
+        return 2
+    return COMMANDS[argv[1]](argv[2:])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))